@@ -6,33 +6,133 @@ from typing import (
     Union,
     Self,
     ClassVar,
-    cast,
     get_args,
     get_origin)
-from functools import cached_property, wraps, partial
-from dataclasses import dataclass, replace
-from contextlib import contextmanager, suppress, ExitStack
+from functools import wraps
+from types import MethodType
+from weakref import WeakKeyDictionary
+from contextlib import AbstractContextManager, contextmanager, nullcontext, ExitStack
+import collections.abc
 import inspect
 
 
 Nothing: Any = object()
 
+_POSITIONAL_MASK = 1 << inspect.Parameter.POSITIONAL_ONLY | 1 << inspect.Parameter.POSITIONAL_OR_KEYWORD
+_KEYWORD_MASK = 1 << inspect.Parameter.KEYWORD_ONLY | 1 << inspect.Parameter.POSITIONAL_OR_KEYWORD
+
+
+def _weakcache[K, V](function: Callable[[K], V]) -> Callable[[K], V]:
+    """ Like `functools.cache` for one argument, but the argument is held weakly,
+        so functions decorated at runtime (e.g. in tests) may be collected
+    """
+
+    results: WeakKeyDictionary[K, V] = WeakKeyDictionary()
+
+    @wraps(function)
+    def cached(key: K) -> V:
+        try:
+            result = results.get(key, Nothing)
+        except TypeError:
+            # not weak referenceable, computed each time
+            return function(key)
+
+        if result is Nothing:
+            result = results[key] = function(key)
+
+        return result
+
+    return cached
+
+
+@_weakcache
+def _signature(function: Callable[..., Any]) -> inspect.Signature:
+    return inspect.signature(function)
+
+
+def _evaluate(annotation: Any, function: Callable[..., Any]) -> Any:
+    """ Evaluate string annotation in `function` globals, the rest as is """
+
+    if not isinstance(annotation, str):
+        return annotation
+
+    return eval(annotation, getattr(inspect.unwrap(function), '__globals__', {}))
+
+
+def _returns(function: Callable[..., Any]) -> Any:
+    """ Evaluated return annotation of `function` (unwrapped) """
+
+    function = inspect.unwrap(function)
+
+    return _evaluate(_signature(function).return_annotation, function)
+
+
+def _yields(function: Callable[..., Any]) -> bool:
+    """ Whether `function` yields value: generator function, or one annotated
+        as returning `Iterator[T]` / `Generator[T, ...]`
+    """
+
+    if inspect.isgeneratorfunction(inspect.unwrap(function)):
+        return True
+
+    return get_origin(_returns(function)) in (collections.abc.Iterator, collections.abc.Generator)
+
+
+def _manages(function: Callable[..., Any]) -> bool:
+    """ Whether `function` is annotated as returning `ContextManager[T]` """
+
+    return get_origin(_returns(function)) is AbstractContextManager
+
 
 def requirement(name: str = 'default', cls: type[Any] | None = None) -> Any:
-    return Requirement[Any](name, cls, 'injector', Nothing)
+    if name == 'default' and cls is None:
+        return _default_requirement
+
+    return Requirement(name, cls, 'injector', Nothing)
 
 
-@dataclass(frozen=True)
 class Requirement[T]:
+    # immutable and hashable like a frozen dataclass; hand-written because
+    # frozen slots dataclass breaks `Requirement[Any](...)` on Python 3.12
+    __slots__ = ('name', 'cls', 'location', 'default', '_clases')
+
     name: str
     cls: type[T] | None
     location: str
     default: T | None
 
-    @cached_property
-    def clases(self) -> tuple[type, ...]:
+    def __init__(self, name: str, cls: type[T] | None, location: str, default: T | None) -> None:
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'cls', cls)
+        object.__setattr__(self, 'location', location)
+        object.__setattr__(self, 'default', default)
+        object.__setattr__(self, '_clases', self._clasify())
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f'cannot assign to field `{name}`')
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f'cannot delete field `{name}`')
+
+    def __repr__(self) -> str:
+        return (f'{type(self).__name__}(name={self.name!r}, cls={self.cls!r}, '
+                f'location={self.location!r}, default={self.default!r})')
+
+    def __eq__(self, other: object) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+
+        return self._fields() == other._fields()  # type: ignore
+
+    def __hash__(self) -> int:
+        return hash(self._fields())
+
+    def _fields(self) -> tuple[Any, ...]:
+        return self.name, self.cls, self.location, self.default
+
+    def _clasify(self) -> tuple[type, ...] | None:
         if not self.cls:
-            raise ValueError()
+            return None
 
         cls = get_origin(self.cls)
 
@@ -43,16 +143,32 @@ class Requirement[T]:
 
         return self.cls,
 
+    @property
+    def clases(self) -> tuple[type, ...]:
+        if self._clases is None:
+            raise ValueError()
+
+        return self._clases
+
     def issuperclass(self, cls: tuple[type[Any]] | type[Any]) -> bool:
-        if not isinstance(cls, tuple):
-            cls = cls,
+        clases = self.clases
+
+        if isinstance(cls, tuple):
+            return any(issubclass(cls, clases) for cls in cls)
 
-        return any(issubclass(cls, self.clases) for cls in cls)
+        return issubclass(cls, clases)
+
+
+# shared by all bare `requirement()` defaults, safe as `Requirement` is frozen
+_default_requirement = Requirement('default', None, 'injector', Nothing)
 
 
 class Definition[T]:
+    __slots__ = ('name', 'cls', '__weakref__')
+
     register: ClassVar[dict[str, type[Self]]] = {}
     mode: str | None = None
+    shared: ClassVar[bool] = False
     cls: type[T]
 
     def __init_subclass__(cls) -> None:
@@ -82,11 +198,25 @@ class Definition[T]:
 
 
 class ContextManagerDefinition[T](Definition[T]):
+    __slots__ = ('_context_manager_factory', '_context_manager_factory_signature')
+
     def __init__(self, name, context_manager_factory: Callable[..., ContextManager[T]]) -> None:
+        function = inspect.unwrap(context_manager_factory)
+
         self._context_manager_factory = context_manager_factory
-        self._context_manager_factory_signature = inspect.signature(context_manager_factory)
+        self._context_manager_factory_signature = _signature(function)
+
+        cls = _returns(function)
+
+        # yielding factory is annotated as `Iterator[T]`, context manager
+        # one as `ContextManager[T]` and plain one as `T`
+        if _yields(function) or _manages(function):
+            cls, *_ = get_args(cls) or (inspect.Signature.empty,)
 
-        cls, = get_args(self._context_manager_factory_signature.return_annotation)
+        # checked here, as not a class definition would break every `search`
+        if cls is inspect.Signature.empty or not isinstance(cls, type):
+            qualname = getattr(function, '__qualname__', None) or repr(function)
+            raise TypeError(f'Definition `{qualname}` must be annotated with class, not `{cls}`')
 
         super().__init__(name, cls)
 
@@ -98,31 +228,47 @@ class ContextManagerDefinition[T](Definition[T]):
 
 
 class SingletonDefinition[T](ContextManagerDefinition[T]):
+    __slots__ = ('_value_manager', '_value')
+
     abstract: ClassVar[bool] = True
     mode: str = 'singleton'
+    shared: ClassVar[bool] = True
 
-    _value_manager: ContextManager[T]
+    _value_manager: ContextManager[T] | None
     _value: T
 
+    def __init__(self, name, context_manager_factory: Callable[..., ContextManager[T]]) -> None:
+        super().__init__(name, context_manager_factory)
+
+        self._value_manager = None
+        self._value = Nothing
+
     def __enter__(self) -> Any:
         self._value_manager = self._context_manager_factory()
         self._value = self._value_manager.__enter__()
 
     def __exit__(self, exc_type, exc_value, traceback) -> Any:
+        if self._value_manager is None:
+            return
+
         self._value_manager.__exit__(None, None, None)
 
-        del self._value_manager
-        del self._value
+        self._value_manager = None
+        self._value = Nothing
 
-    @contextmanager
-    def value(self, options: dict[str, Any] | None = None) -> Iterator[T]:
-        if not self._value:
+    def get(self) -> T:
+        if self._value is Nothing:
             raise ValueError()
 
-        yield self._value
+        return self._value
+
+    def value(self, options: dict[str, Any] | None = None) -> ContextManager[T]:
+        return nullcontext(self.get())
 
 
 class TransientDefinition[T](ContextManagerDefinition[T]):
+    __slots__ = ()
+
     abstract: ClassVar[bool] = True
     mode: str = 'transient'
 
@@ -130,20 +276,43 @@ class TransientDefinition[T](ContextManagerDefinition[T]):
         return self._context_manager_factory()
 
 
-type InjectorDefiner[T, **P] = Callable[[Callable[P, Iterator[T]]], Callable[P, Iterator[T]]]
+def _valuemanager[T, **P](function: Callable[P, T]) -> Callable[P, ContextManager[T]]:
+    """ Like `contextlib.contextmanager`, but for function returning value without cleanup """
+
+    @wraps(function)
+    def factory(*args: P.args, **kwargs: P.kwargs) -> ContextManager[T]:
+        return nullcontext(function(*args, **kwargs))
+
+    return factory
+
+
+type InjectorDefiner[T, **P] = Callable[[Callable[P, Iterator[T] | T]], Callable[P, Iterator[T] | T]]
 
 
 class Injector:
+    __slots__ = ('_definitions', '_search_cache', '_stack', '__weakref__')
+
     def __init__(self) -> None:
         self._definitions: list[ContextManagerDefinition[Any]] = []
+        self._search_cache: dict[tuple[Any, str], ContextManagerDefinition[Any]] = {}
+        self._stack: ExitStack | None = None
 
     def __enter__(self) -> Any:
-        for definition in self._definitions:
-            definition.__enter__()
+        # if some definition fails to enter, the already entered are exited
+        with ExitStack() as stack:
+            for definition in self._definitions:
+                stack.enter_context(definition)
+
+            self._stack = stack.pop_all()
 
     def __exit__(self, exc_type, exc_value, traceback) -> Any:
-        for definition in self._definitions:
-            definition.__exit__(exc_type, exc_value, traceback)
+        if self._stack is None:
+            return
+
+        # exited in reverse order, so definitions may depend on earlier ones
+        stack, self._stack = self._stack, None
+
+        return stack.__exit__(exc_type, exc_value, traceback)
 
     def executor[T, **P](self, function: Callable[P, T]) -> Callable[P, T]:
         """ Example:
@@ -155,8 +324,15 @@ class Injector:
             
             function()  # `service` will inject implicit by injector
             ```
+
+            Function without requirements is returned as is.
         """
 
+        parameters = _signature(function).parameters.values()
+
+        if not any(isinstance(parameter.default, Requirement) for parameter in parameters):
+            return function
+
         return wraps(function)(Executor(self, function))
 
     def define[T, **P](self, scope: str, name: str = 'default') -> InjectorDefiner[T, P]:
@@ -167,14 +343,29 @@ class Injector:
             def service_definition() -> Iterator[Service]:
                 yield Service()
             ```
+
+            Function without cleanup may return value instead of yield it:
+
+            ```
+            @injector.define('transient')
+            def service_definition() -> Service:
+                return Service()
+            ```
         """
 
         Cls = ContextManagerDefinition.register[scope]  # noqa
 
-        def definer(function: Callable[P, Iterator[T]]) -> Callable[P, Iterator[T]]:
+        def definer(function: Callable[P, Iterator[T] | T]) -> Callable[P, Iterator[T] | T]:
+            if _yields(function):
+                context_manager_factory = contextmanager(function)
+            elif _manages(function):
+                context_manager_factory = function
+            else:
+                context_manager_factory = _valuemanager(function)
+
             self._definitions.append(Cls(
                 name=name,
-                context_manager_factory=contextmanager(function),
+                context_manager_factory=context_manager_factory,
             ))
 
             return function
@@ -182,63 +373,180 @@ class Injector:
         return definer
 
     def search[T](self, requirement: Requirement[T]) -> ContextManagerDefinition[T] | None:
+        # definitions are append-only and the first match wins, so a found
+        # definition stays valid forever; misses are not cached
+        key = requirement.cls, requirement.name
+
+        if definition := self._search_cache.get(key):
+            return definition
+
         for definition in self._definitions:
             if requirement.issuperclass(definition.cls) and (
                     definition.name is None or definition.name == requirement.name):
+                self._search_cache[key] = definition
                 return definition
 
+    def resolve[T](self, requirement: Requirement[T]) -> ContextManagerDefinition[T]:
+        definition = self.search(requirement)
+
+        if definition is None:
+            raise LookupError(f'No definition for `{requirement.name}` of `{requirement.cls}`')
+
+        return definition
+
     def value[T](self,
                  requirement: Requirement[T],
                  args: tuple[Any, ...] | None = None,
                  kwargs: dict[str, Any] | None = None) -> ContextManager[T]:
 
-        definition = self.search(requirement)
-
-        if not definition:
-            raise LookupError()
+        definition = self.resolve(requirement)
 
         return definition.value({'requirement': requirement, 'args': args, 'kwargs': kwargs})
 
 
+@_weakcache
+def _plan(function: Callable[..., Any]) -> tuple[tuple[int, str, int, Requirement[Any]], ...]:
+    """ Injectable parameters of `function` as `(position, name, 1 << kind, requirement)` """
+
+    plan = []
+
+    for position, parameter in enumerate(_signature(function).parameters.values()):
+        requirement = parameter.default
+
+        if not isinstance(requirement, Requirement):
+            continue
+
+        requirement = Requirement(
+            requirement.name or parameter.name,
+            requirement.cls or _evaluate(parameter.annotation, function),
+            requirement.location,
+            requirement.default)
+
+        plan.append((position, parameter.name, 1 << parameter.kind, requirement))
+
+    return tuple(plan)
+
+
 class Executor[T, **P]:
+    # `__dict__` keeps room for the metadata copied by `functools.wraps`,
+    # `__weakref__` lets executors be keys of weak caches like plain functions
+    __slots__ = ('_injector', '_function', '_plan', '_call', '__dict__', '__weakref__')
+
     def __init__(self, injector: Injector, function: Callable[P, T]) -> None:
         self._injector = injector
         self._function = function
-        self._signature = inspect.signature(self._function)
+        self._plan = None
+        self._call = None
 
-    def __call__(self, *args: P.args, **kwargs: P.kwargs) -> T:  # type: ignore (type checking incorrect with retutn inside ExitStack)
-        injections: dict[str, ContextManager[Any]] = {}
+    def _prepare(self) -> Callable[[tuple[Any, ...], dict[str, Any]], T]:
+        # deferred to the first call, so string annotations may refer to
+        # classes defined after decoration
+        self._plan = _plan(self._function)
+        self._call = self._compile()
 
-        for position, parameter in enumerate(self._signature.parameters.values()):
-            requirement = parameter.default
+        return self._call
 
-            if not isinstance(requirement, Requirement):
-                continue
+    def _compile(self) -> Callable[[tuple[Any, ...], dict[str, Any]], T]:
+        """ Generate call function specialized for the plan, e.g.:
 
-            requirement = replace(
-                requirement, cls=requirement.cls or parameter.annotation, name=requirement.name or parameter.name)
+            ```
+            def call(args, kwargs):
+                nargs = len(args)
+                injections = []
 
-            requirement = cast(Requirement[Any], requirement)
+                if nargs <= 0 and 'service' not in kwargs:
+                    definition = definitions[0]
 
-            arg = Nothing
+                    if definition is None:
+                        definition = definitions[0] = resolve(requirement_0)
 
-            if parameter.kind in [inspect.Parameter.POSITIONAL_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD]:
-                with suppress(IndexError):
-                    arg = args[position]
+                    if definition.shared:
+                        kwargs['service'] = definition.get()
+                    else:
+                        options = {'requirement': requirement_0, 'args': None, 'kwargs': None}
+                        injections.append(('service', definition.value(options)))
 
-            if arg is Nothing and parameter.kind in [inspect.Parameter.KEYWORD_ONLY, inspect.Parameter.POSITIONAL_OR_KEYWORD]:
-                with suppress(KeyError):
-                    arg = kwargs[parameter.name]
+                if not injections:
+                    return function(*args, **kwargs)
 
-            if arg is Nothing:
-                injections[parameter.name] = self._injector.value(requirement)
+                if len(injections) == 1:
+                    (name, injection), = injections
 
-        with ExitStack() as stack:
-            kwargs = kwargs | {
-                name: stack.enter_context(injection) for name, injection in injections.items()
-            }  # type: ignore
+                    with injection as kwargs[name]:
+                        return function(*args, **kwargs)
+
+                with ExitStack() as stack:
+                    for name, injection in injections:
+                        kwargs[name] = stack.enter_context(injection)
+
+                    return function(*args, **kwargs)
+            ```
+        """
+
+        # everything the call function needs is passed to `create` and
+        # captured as closure cells, so lookups inside `call` are not globals;
+        # `definitions` memoizes resolved definitions, a found one never changes
+        closure: dict[str, Any] = {
+            'ExitStack': ExitStack,
+            'resolve': self._injector.resolve,
+            'function': self._function,
+            'definitions': [None] * len(self._plan),
+        }
+
+        lines = [
+            'def call(args, kwargs):',
+            '    nargs = len(args)',
+            '    injections = []',
+        ]
+
+        for index, (position, name, kind, requirement) in enumerate(self._plan):
+            closure[f'requirement_{index}'] = requirement
+
+            conditions = []
+
+            if kind & _POSITIONAL_MASK:
+                conditions.append(f'nargs <= {position}')
+
+            if kind & _KEYWORD_MASK:
+                conditions.append(f'{name!r} not in kwargs')
+
+            condition = ' and '.join(conditions)
+
+            lines.append(f'    if {condition}:')
+            lines.append(f'        definition = definitions[{index}]')
+            lines.append('        if definition is None:')
+            lines.append(f'            definition = definitions[{index}] = resolve(requirement_{index})')
+            lines.append('        if definition.shared:')
+            lines.append(f'            kwargs[{name!r}] = definition.get()')
+            lines.append('        else:')
+            lines.append(f"            options = {{'requirement': requirement_{index}, 'args': None, 'kwargs': None}}")
+            lines.append(f'            injections.append(({name!r}, definition.value(options)))')
+
+        lines.append('    if not injections:')
+        lines.append('        return function(*args, **kwargs)')
+        lines.append('    if len(injections) == 1:')
+        lines.append('        (name, injection), = injections')
+        lines.append('        with injection as kwargs[name]:')
+        lines.append('            return function(*args, **kwargs)')
+        lines.append('    with ExitStack() as stack:')
+        lines.append('        for name, injection in injections:')
+        lines.append('            kwargs[name] = stack.enter_context(injection)')
+        lines.append('        return function(*args, **kwargs)')
+
+        parameters = ', '.join(closure)
+        lines = [f'def create({parameters}):', *(f'    {line}' for line in lines), '    return call']
+        namespace: dict[str, Any] = {}
+
+        filename = getattr(self._function, '__qualname__', None) or repr(self._function)
+
+        exec(compile('\n'.join(lines), f'<executor {filename}>', 'exec'), namespace)
+
+        return namespace['create'](**closure)
+
+    def __call__(self, *args: P.args, **kwargs: P.kwargs) -> T:
+        call = self._call or self._prepare()
+
+        return call(args, kwargs)
 
-            return self._function(*args, **kwargs)
- 
     def __get__(self, instance: Any | None, cls: type[Any]) -> Callable[..., T]:
-        return partial(self, instance or cls)
+        return MethodType(self, cls if instance is None else instance)
@@ -0,0 +1,9 @@
+import pytest
+from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+
+@pytest.fixture(scope='session')
+def pool() -> Iterator[ThreadPoolExecutor]:
+    with ThreadPoolExecutor(1000) as pool:
+        yield pool
@@ -1,7 +1,11 @@
+import gc
+import weakref
 import pytest
 from ioclib.injector import Injector, Requirement, requirement
-from typing import Iterator
+from typing import Any, ContextManager, Iterable, Iterator
+from contextlib import nullcontext
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 
 class ClosableService:
@@ -104,7 +108,7 @@ def test_lookup_error_inject() -> None:
     def main(undefined_service: UndefinedService = requirement()) -> None:
         pass
 
-    with pytest.raises(LookupError):
+    with pytest.raises(LookupError, match='UndefinedService'):
         main()
 
 
@@ -133,9 +137,7 @@ def test_without_injectable_inject() -> None:
     main()
 
 
-def test_multitrheading() -> None:
-    pool = ThreadPoolExecutor(1000)
-
+def test_multitrheading(pool: ThreadPoolExecutor) -> None:
     injector = Injector()
 
     @injector.define('singleton')
@@ -223,3 +225,341 @@ def test_transient_count() -> None:
 
     assert enter_count == times
     assert exit_count == times
+
+
+def test_late_define() -> None:
+    injector = Injector()
+
+    @injector.executor
+    def main(temperature_service: TemperatureService = requirement()) -> TemperatureService:
+        return temperature_service
+
+    with pytest.raises(LookupError):
+        main()
+
+    @injector.define('transient')
+    def temperature_service_def() -> Iterator[TemperatureService]:
+        yield TemperatureService(0)
+
+    assert main() is not main()
+
+
+def test_explicit_arguments() -> None:
+    injector = Injector()
+
+    @injector.define('singleton')
+    def temperature_service_def() -> Iterator[TemperatureService]:
+        yield TemperatureService(0)
+
+    @injector.executor
+    def main(value: float,
+             temperature_service: TemperatureService = requirement(), *,
+             time_service: TimeService = TimeService(0)) -> tuple[float, float]:
+        return temperature_service.temperature, time_service.time
+
+    with injector:
+        assert main(1) == (0, 0)
+        assert main(1, TemperatureService(2)) == (2, 0)
+        assert main(1, temperature_service=TemperatureService(3)) == (3, 0)
+        assert main(value=1, temperature_service=TemperatureService(4), time_service=TimeService(5)) == (4, 5)
+
+
+def test_injectable_falsy_instance() -> None:
+    injector = Injector()
+
+    @injector.define('singleton')
+    def temperature_service_def() -> Iterator[TemperatureService]:
+        yield TemperatureService(0)
+
+    class Class:
+        def __len__(self) -> int:
+            return 0
+
+        @injector.executor
+        def method(self, temperature_service: TemperatureService = requirement()) -> 'Class':
+            return self
+
+    cls = Class()
+
+    with injector:
+        assert cls.method() is cls
+
+
+def test_keyword_only_inject() -> None:
+    injector = Injector()
+
+    @injector.define('singleton')
+    def temperature_service_def() -> Iterator[TemperatureService]:
+        yield TemperatureService(0)
+
+    @injector.executor
+    def main(*args: float, temperature_service: TemperatureService = requirement()) -> float:
+        return sum(args) + temperature_service.temperature
+
+    with injector:
+        assert main(1, 2) == 3
+        assert main(1, 2, temperature_service=TemperatureService(3)) == 6
+
+
+def test_singleton_falsy_inject() -> None:
+    class FalsyService:
+        def __bool__(self) -> bool:
+            return False
+
+    injector = Injector()
+
+    @injector.define('singleton')
+    def falsy_service_def() -> Iterator[FalsyService]:
+        yield FalsyService()
+
+    @injector.executor
+    def main(falsy_service: FalsyService = requirement()) -> FalsyService:
+        return falsy_service
+
+    with pytest.raises(ValueError):
+        main()
+
+    for _ in range(2):
+        with injector:
+            assert isinstance(main(), FalsyService)
+
+        with pytest.raises(ValueError):
+            main()
+
+
+def test_string_annotations_inject() -> None:
+    injector = Injector()
+
+    @injector.define('singleton')
+    def temperature_service_def() -> 'Iterator[TemperatureService]':
+        yield TemperatureService(0)
+
+    @injector.executor
+    def main(temperature_service: 'TemperatureService' = requirement()) -> float:
+        return temperature_service.temperature
+
+    with injector:
+        assert main() == 0
+
+
+def test_singleton_enter_exit_order() -> None:
+    class TestError(Exception):
+        pass
+
+    injector = Injector()
+    events = []
+
+    @injector.define('singleton')
+    def temperature_service_def() -> Iterator[TemperatureService]:
+        events.append('enter temperature')
+        yield TemperatureService(0)
+        events.append('exit temperature')
+
+    @injector.define('singleton')
+    def time_service_def() -> Iterator[TimeService]:
+        events.append('enter time')
+        yield TimeService(0)
+        events.append('exit time')
+
+    with injector:
+        pass
+
+    assert events == ['enter temperature', 'enter time', 'exit time', 'exit temperature']
+
+    @injector.define('singleton')
+    def closable_service_def() -> Iterator[ClosableService]:
+        raise TestError
+        yield
+
+    events.clear()
+
+    with pytest.raises(TestError), injector:
+        pass
+
+    assert events == ['enter temperature', 'enter time', 'exit time', 'exit temperature']
+
+
+def test_executor_function_collectable() -> None:
+    injector = Injector()
+
+    @injector.define('singleton')
+    def temperature_service_def() -> Iterator[TemperatureService]:
+        yield TemperatureService(0)
+
+    def main(temperature_service: TemperatureService = requirement()) -> TemperatureService:
+        return temperature_service
+
+    executor = injector.executor(main)
+
+    with injector:
+        executor()
+
+    reference = weakref.ref(main)
+    del main, executor
+    gc.collect()
+
+    assert reference() is None
+
+
+def test_without_requirements_executor() -> None:
+    injector = Injector()
+
+    def main(value: float, time_service: TimeService = TimeService(0)) -> float:
+        return value
+
+    assert injector.executor(main) is main
+
+
+def test_plain_function_define() -> None:
+    injector = Injector()
+
+    @injector.define('singleton')
+    def temperature_service_def() -> TemperatureService:
+        return TemperatureService(0)
+
+    @injector.define('transient')
+    def time_service_def() -> TimeService:
+        return TimeService(0)
+
+    @injector.executor
+    def main(temperature_service: TemperatureService = requirement(),
+             time_service: TimeService = requirement()) -> tuple[TemperatureService, TimeService]:
+        return temperature_service, time_service
+
+    with injector:
+        temperature_service_1, time_service_1 = main()
+        temperature_service_2, time_service_2 = main()
+
+    assert temperature_service_1 is temperature_service_2
+    assert time_service_1 is not time_service_2
+
+
+def test_requirement_frozen() -> None:
+    marker = requirement()
+
+    assert hash(marker) == hash(requirement())
+
+    with pytest.raises(AttributeError):
+        marker.name = 'other'
+
+
+def test_partial_executor() -> None:
+    injector = Injector()
+
+    @injector.define('singleton')
+    def temperature_service_def() -> Iterator[TemperatureService]:
+        yield TemperatureService(0)
+
+    def main(value: float, temperature_service: TemperatureService = requirement()) -> float:
+        return value + temperature_service.temperature
+
+    executor = injector.executor(partial(main, 1))
+
+    with injector:
+        assert executor() == 1
+
+
+def test_weak_referenceable() -> None:
+    injector = Injector()
+
+    @injector.define('singleton')
+    def temperature_service_def() -> Iterator[TemperatureService]:
+        yield TemperatureService(0)
+
+    @injector.executor
+    def main(temperature_service: TemperatureService = requirement()) -> None:
+        pass
+
+    definition, = injector._definitions
+
+    assert weakref.ref(injector)() is injector
+    assert weakref.ref(main)() is main
+    assert weakref.ref(definition)() is definition
+
+
+def test_unresolvable_annotation_error() -> None:
+    injector = Injector()
+
+    @injector.executor
+    def main(undefined_service: 'MissingService' = requirement()) -> None:  # type: ignore # noqa
+        pass
+
+    with pytest.raises(NameError) as error:
+        main()
+
+    assert error.value.__context__ is None
+
+
+def test_iterator_returning_define() -> None:
+    injector = Injector()
+
+    def temperature_service_gen() -> Iterator[TemperatureService]:
+        yield TemperatureService(0)
+
+    @injector.define('transient')
+    def temperature_service_def() -> Iterator[TemperatureService]:
+        return temperature_service_gen()
+
+    @injector.executor
+    def main(temperature_service: TemperatureService = requirement()) -> TemperatureService:
+        return temperature_service
+
+    assert isinstance(main(), TemperatureService)
+
+
+def test_requirement_generic_build() -> None:
+    marker = Requirement[Any]('default', None, 'injector', None)
+
+    assert marker == Requirement('default', None, 'injector', None)
+
+    with pytest.raises(AttributeError):
+        del marker.name
+
+
+def test_iterable_generator_define() -> None:
+    injector = Injector()
+
+    @injector.define('transient')
+    def temperature_service_def() -> Iterable[TemperatureService]:
+        yield TemperatureService(0)
+
+    @injector.define('transient')
+    def time_service_def() -> Iterator[TimeService]:
+        yield TimeService(0)
+
+    @injector.executor
+    def main(temperature_service: TemperatureService = requirement(),
+             time_service: TimeService = requirement()) -> None:
+        assert isinstance(temperature_service, TemperatureService)
+        assert isinstance(time_service, TimeService)
+
+    main()
+
+
+def test_context_manager_define() -> None:
+    injector = Injector()
+
+    @injector.define('singleton')
+    def temperature_service_def() -> ContextManager[TemperatureService]:
+        return nullcontext(TemperatureService(0))
+
+    @injector.executor
+    def main(temperature_service: TemperatureService = requirement()) -> TemperatureService:
+        return temperature_service
+
+    with injector:
+        assert main() is main()
+
+
+def test_unannotated_define() -> None:
+    injector = Injector()
+
+    with pytest.raises(TypeError):
+        @injector.define('singleton')
+        def temperature_service_def():  # type: ignore
+            yield TemperatureService(0)
+
+    with pytest.raises(TypeError):
+        @injector.define('transient')
+        def time_service_def():  # type: ignore
+            return TimeService(0)